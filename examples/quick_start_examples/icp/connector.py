@@ -1,9 +1,26 @@
+import functools
 import requests
 import time
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
 from fivetran_connector_sdk import Connector
 from fivetran_connector_sdk import Operations as op
 from fivetran_connector_sdk import Logging as log
 
+# Module-level session so the connection pool stays warm across update() calls
+# Retries on transient errors are handled by urllib3 (honors Retry-After on 429/503)
+_SESSION = requests.Session()
+_SESSION.mount('https://', HTTPAdapter(
+    pool_connections=4,
+    pool_maxsize=8,
+    max_retries=Retry(
+        total=3,
+        backoff_factor=1,
+        status_forcelist=[429, 500, 502, 503, 504],
+        raise_on_status=False
+    )
+))
+
 def schema(configuration: dict):
     """Define the minimal table schema for Fivetran"""
     # Validate configuration
@@ -37,10 +54,8 @@ def update(configuration: dict, state: dict):
     
     page_size = int(configuration.get('page_size', '100'))
     
-    # Add the x-api-key to the session headers
-    headers = {"x-api-key": api_key}
-    session = requests.Session()
-    session.headers.update(headers)
+    # Add the x-api-key to the shared session headers
+    _SESSION.headers["x-api-key"] = api_key
     
     # Retrieve the state for change data capture
     next_cursor = state.get('next_cursor')
@@ -54,6 +69,9 @@ def update(configuration: dict, state: dict):
     else:
         log.info("Starting initial sync")
     
+    # Pre-bind the table name so records can be emitted without a Python-level loop
+    upsert_record = functools.partial(op.upsert, "icp_records")
+    
     record_count = 0
     has_more = True
     iteration_count = 0
@@ -64,29 +82,22 @@ def update(configuration: dict, state: dict):
             iteration_count += 1
             
             try:
-                # Make API request with retry logic
-                for attempt in range(3):
-                    try:
-                        response = session.get(url, params=params)
-                        response.raise_for_status()
-                        break
-                    except requests.exceptions.RequestException as e:
-                        if attempt == 2:
-                            raise
-                        log.warning(f"Request failed (attempt {attempt + 1}/3): {str(e)}")
-                        time.sleep(2 ** attempt)  # Exponential backoff
+                # Make API request (retries handled by the session adapter)
+                response = _SESSION.get(url, params=params)
+                response.raise_for_status()
                 
                 data = response.json()
                 
                 # Process records - look for the icp_records key in the response
                 records = data.get("icp_records", [])
-                for record in records:
-                    # Ensure the record has an ID
-                    if 'record_id' in record:
-                        yield op.upsert("icp_records", record)
-                        record_count += 1
-                    else:
-                        log.warning(f"Skipping record without ID: {record}")
+                # Ensure each record has an ID
+                valid_records = [record for record in records if 'record_id' in record]
+                skipped_count = len(records) - len(valid_records)
+                if skipped_count:
+                    log.warning(f"Skipping {skipped_count} records without ID")
+                
+                yield from map(upsert_record, valid_records)
+                record_count += len(valid_records)
                 
                 # Update pagination info
                 next_cursor = data.get("next_cursor")
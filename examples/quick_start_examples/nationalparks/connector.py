@@ -1,24 +1,63 @@
+import asyncio
+import hashlib
 import json
 import os
 import time
-from datetime import datetime
-import requests as rq
-from requests.adapters import HTTPAdapter
-from requests.packages.urllib3.util.retry import Retry
+from datetime import datetime, timezone
+from email.utils import parsedate_to_datetime
+import aiohttp
+from aiolimiter import AsyncLimiter
+import simdjson
 from fivetran_connector_sdk import Connector
 from fivetran_connector_sdk import Logging
 from fivetran_connector_sdk import Operations as op
 
-def create_retry_session():
-    """Create a requests session with retry logic"""
-    session = rq.Session()
-    retries = Retry(
-        total=3,
-        backoff_factor=1,
-        status_forcelist=[408, 429, 500, 502, 503, 504]
-    )
-    session.mount('https://', HTTPAdapter(max_retries=retries))
-    return session
+# Decode responses with simdjson so only the fields we read become Python objects
+simdjson_parser = simdjson.Parser()
+
+# Pre-serialized value for the common empty-list case
+EMPTY_JSON_LIST = "[]"
+
+# Bounded concurrency for the NPS API fan-out
+MAX_CONCURRENT_REQUESTS = 32
+REQUEST_TIMEOUT = 30
+MAX_RETRIES = 3
+PAGE_SIZE = 500
+UPSERT_BATCH_SIZE = 500
+
+# Record fields read from each endpoint; the rest of each record is never materialized
+RESPONSE_FIELDS = {
+    "parks": ("id", "parkCode", "fullName", "description", "states", "latitude", "longitude",
+              "activities", "designation", "entranceFees", "entrancePasses"),
+    "thingstodo": ("id", "title", "shortDescription", "accessibilityInformation", "location",
+                   "url", "duration", "tags", "relatedParks")
+}
+
+# Designations treated as National Parks (anything else ending in "National Park" is also kept)
+NATIONAL_PARK_DESIGNATIONS = frozenset({
+    "National Park",
+    "National Park & Preserve",
+    "National Park and Preserve",
+    "National Parks",
+    "National and State Parks"
+})
+RETRY_STATUS_CODES = {408, 429, 500, 502, 503, 504}
+DEFAULT_RETRY_AFTER = 60
+
+# Token bucket kept just under the NPS hourly quota while still allowing short bursts
+NPS_RATE_LIMITER = AsyncLimiter(max_rate=40, time_period=60)
+
+# On-disk response cache for repeated local debug runs only (set NPS_CACHE=1 to enable);
+# syncs always hit the API so they never receive cached data or write into files/
+CACHE_DIR = os.path.join("files", "nps_cache")
+CACHE_EXPIRE_SECONDS = 3600
+CACHE_ENABLED = os.environ.get("NPS_CACHE", "").lower() in ("1", "true", "yes")
+
+# Verbose per-request logging for troubleshooting (set NPS_DEBUG=1 to enable)
+NPS_DEBUG = bool(os.environ.get("NPS_DEBUG"))
+
+# In-flight requests keyed by (endpoint, params) so duplicate calls share one response
+_inflight = {}
 
 def get_api_key(configuration):
     """Retrieve the API key from the configuration."""
@@ -79,179 +118,329 @@ def schema(configuration: dict):
         }
     ]
 
-def make_api_request(session, endpoint, params):
-    """Make API request with error handling and logging"""
+def parse_retry_after(value, default=DEFAULT_RETRY_AFTER):
+    """Convert a Retry-After header (delta-seconds or HTTP-date) into seconds to wait"""
+    if not value:
+        return default
     try:
-        # Create a copy of params with masked API key for logging
-        log_params = params.copy()
-        if 'api_key' in log_params:
-            log_params['api_key'] = '***'
-        
-        Logging.warning(f"Making request to {endpoint} with params: {log_params}")
-        response = session.get(endpoint, params=params, timeout=30)
-        response.raise_for_status()
-        data = response.json()
-        Logging.warning(f"Response total count: {len(data.get('data', []))}")
-        if len(data.get('data', [])) > 0:
-            Logging.warning("Sample of first response item:")
-            first_item = data['data'][0]
-            Logging.warning(f"Name: {first_item.get('fullName')}")
-            Logging.warning(f"Designation: {first_item.get('designation')}")
-            Logging.warning(f"Park Code: {first_item.get('parkCode')}")
-        return data
-    except rq.exceptions.RequestException as e:
-        Logging.warning(f"API request failed for {endpoint}: {str(e)}")
-        if hasattr(response, 'status_code') and response.status_code == 429:
-            Logging.warning("Rate limit hit, waiting 60 seconds...")
-            time.sleep(60)
-            return make_api_request(session, endpoint, params)
-        return {"data": [], "total": 0}
+        return max(0, int(value))
+    except ValueError:
+        pass
+    try:
+        retry_at = parsedate_to_datetime(value)
+        return max(0, (retry_at - datetime.now(timezone.utc)).total_seconds())
+    except (TypeError, ValueError):
+        return default
+
+def project_record(item, fields):
+    """Materialize only the requested fields of a simdjson record as plain Python values"""
+    record = {}
+    for field in fields:
+        if field in item:
+            value = item[field]
+            if isinstance(value, simdjson.Object):
+                value = value.as_dict()
+            elif isinstance(value, simdjson.Array):
+                value = value.as_list()
+            record[field] = value
+    return record
+
+def decode_response(endpoint, payload):
+    """Decode a response body with simdjson, projecting records to the fields in RESPONSE_FIELDS"""
+    fields = RESPONSE_FIELDS.get(endpoint.rsplit("/", 1)[-1])
+    doc = simdjson_parser.parse(payload)
+    if fields is None:
+        try:
+            return doc.as_dict()
+        finally:
+            del doc
+    try:
+        records = [project_record(item, fields) for item in doc["data"]] if "data" in doc else []
+        total = doc["total"] if "total" in doc else 0
+    finally:
+        # Release the reference into the parser's buffer before it is reused
+        del doc
+    return {"data": records, "total": total}
+
+def get_cache_path(endpoint, params):
+    """Build the cache file path for an endpoint and its query parameters"""
+    key = hashlib.sha256(f"{endpoint}?{sorted(params.items())}".encode()).hexdigest()
+    return os.path.join(CACHE_DIR, f"{key}.json")
+
+def read_cached_response(endpoint, params):
+    """Return the cached response body if it exists and has not expired"""
+    if not CACHE_ENABLED:
+        return None
+    cache_path = get_cache_path(endpoint, params)
+    try:
+        if time.time() - os.path.getmtime(cache_path) < CACHE_EXPIRE_SECONDS:
+            with open(cache_path, "rb") as f:
+                return f.read()
+    except OSError:
+        pass
+    return None
+
+def write_cached_response(endpoint, params, payload):
+    """Store a successful response body in the on-disk cache"""
+    if not CACHE_ENABLED:
+        return
+    try:
+        os.makedirs(CACHE_DIR, exist_ok=True)
+        with open(get_cache_path(endpoint, params), "wb") as f:
+            f.write(payload)
+    except OSError as e:
+        Logging.warning(f"Unable to write response cache for {endpoint}: {str(e)}")
+
+async def fetch_api_response(session, semaphore, endpoint, params):
+    """Make an async API request with bounded concurrency, retries and logging"""
+    # Create a copy of params with masked API key for logging
+    log_params = params.copy()
+    if 'api_key' in log_params:
+        log_params['api_key'] = '***'
+
+    cached = read_cached_response(endpoint, params)
+    if cached is not None:
+        if NPS_DEBUG:
+            Logging.warning(f"Using cached response for {endpoint} with params: {log_params}")
+        return decode_response(endpoint, cached)
+
+    for attempt in range(MAX_RETRIES):
+        try:
+            async with semaphore, NPS_RATE_LIMITER:
+                if NPS_DEBUG:
+                    Logging.warning(f"Making request to {endpoint} with params: {log_params}")
+                async with session.get(endpoint, params=params) as response:
+                    response.raise_for_status()
+                    payload = await response.read()
+            data = decode_response(endpoint, payload)
+            write_cached_response(endpoint, params, payload)
+            if NPS_DEBUG:
+                items = data.get('data', [])
+                first_item = items[0] if items else {}
+                Logging.warning(
+                    f"Response total count: {len(items)} | First item: {first_item.get('fullName')} "
+                    f"| Designation: {first_item.get('designation')} | Park Code: {first_item.get('parkCode')}"
+                )
+            return data
+        except aiohttp.ClientResponseError as e:
+            Logging.warning(f"API request failed for {endpoint}: {str(e)}")
+            if e.status not in RETRY_STATUS_CODES or attempt == MAX_RETRIES - 1:
+                break
+            if e.status == 429:
+                retry_after = parse_retry_after(e.headers.get("Retry-After") if e.headers else None)
+                Logging.warning(f"Rate limit hit, waiting {retry_after} seconds...")
+                await asyncio.sleep(retry_after)
+            else:
+                await asyncio.sleep(2 ** attempt)
+        except (aiohttp.ClientError, asyncio.TimeoutError) as e:
+            Logging.warning(f"API request failed for {endpoint}: {str(e)}")
+            if attempt == MAX_RETRIES - 1:
+                break
+            await asyncio.sleep(2 ** attempt)
+    return {"data": [], "total": 0}
+
+async def make_api_request(session, semaphore, endpoint, params):
+    """Make an API request, awaiting an identical in-flight request instead of issuing a duplicate"""
+    key = (endpoint, frozenset(params.items()))
+    task = _inflight.get(key)
+    if task is None:
+        task = asyncio.ensure_future(fetch_api_response(session, semaphore, endpoint, params))
+        _inflight[key] = task
+        task.add_done_callback(lambda _: _inflight.pop(key, None))
+    return await task
+
+async def fetch_all_pages(session, semaphore, endpoint, base_params):
+    """Fetch the first page of an NPS endpoint, then all remaining pages concurrently"""
+    first_page = await make_api_request(session, semaphore, endpoint, {**base_params, "start": 0})
+    items = list(first_page.get("data", []))
+    total = int(first_page.get("total", 0) or 0)
+    page_size = base_params["limit"]
+
+    # Every remaining page is independent I/O once the total is known
+    remaining_pages = await asyncio.gather(*[
+        make_api_request(session, semaphore, endpoint, {**base_params, "start": start})
+        for start in range(page_size, total, page_size)
+    ])
+    for page in remaining_pages:
+        items.extend(page.get("data", []))
+    return items
+
+async def fetch_national_parks(session, semaphore, base_url, base_params):
+    """Fetch all parks in bulk and keep only National Park designations"""
+    parks = await fetch_all_pages(session, semaphore, f"{base_url}/parks", base_params)
+
+    all_parks = []
+    for park in parks:
+        designation = park.get("designation", "")
+        # Include variations of National Park designations
+        if designation in NATIONAL_PARK_DESIGNATIONS or designation.endswith("National Park"):
+            all_parks.append(park)
+    Logging.warning(f"Found {len(all_parks)} National Parks: {[park.get('parkCode') for park in all_parks]}")
+    return all_parks
+
+async def fetch_things_to_do(session, semaphore, base_url, base_params):
+    """Fetch all things to do in one paginated sweep"""
+    return await fetch_all_pages(session, semaphore, f"{base_url}/thingstodo", base_params)
+
+def join_things_to_do(park_by_code, activities):
+    """Pair each activity with the first related park found in park_by_code"""
+    park_activities = []
+    for activity in activities:
+        for related_park in activity.get("relatedParks", []):
+            park = park_by_code.get(related_park.get("parkCode"))
+            if park is not None:
+                park_activities.append((park, activity))
+                break
+    return park_activities
+
+async def collect_nps_data(base_url, api_key):
+    """Fetch parks and things to do concurrently on a single pooled aiohttp session"""
+    # Pool sized to the concurrency limit so every in-flight request can reuse a kept-alive connection
+    connector = aiohttp.TCPConnector(limit=MAX_CONCURRENT_REQUESTS, limit_per_host=MAX_CONCURRENT_REQUESTS)
+    timeout = aiohttp.ClientTimeout(total=REQUEST_TIMEOUT)
+    semaphore = asyncio.Semaphore(MAX_CONCURRENT_REQUESTS)
+    # Shared by every paginated request; only "start" varies per page
+    base_params = {"api_key": api_key, "limit": PAGE_SIZE}
+    async with aiohttp.ClientSession(connector=connector, timeout=timeout) as session:
+        # The two sweeps are independent, so overlap them and join afterwards
+        all_parks, activities = await asyncio.gather(
+            fetch_national_parks(session, semaphore, base_url, base_params),
+            fetch_things_to_do(session, semaphore, base_url, base_params)
+        )
+    return all_parks, activities
+
+def to_float(value):
+    """Convert a numeric or numeric-string value to float, returning None for empty or invalid values"""
+    if value is None or value == "" or value == "None":
+        return None
+    try:
+        return float(value)
+    except (TypeError, ValueError):
+        return None
+
+def build_park_row(park):
+    """Build a parks table row from an NPS park record"""
+    park_get = park.get
+    activities = park_get("activities")
+    return {
+        "park_id": park_get("id", "Unknown ID"),
+        "name": park_get("fullName", "No Name"),
+        "description": park_get("description", "No Description"),
+        "state": park_get("states", ""),
+        "latitude": to_float(park_get("latitude")),
+        "longitude": to_float(park_get("longitude")),
+        "activities": json.dumps([activity["name"] for activity in activities]) if activities else EMPTY_JSON_LIST,
+        "designation": park_get("designation", "")
+    }
+
+def build_feespass_row(item, park_id, park_name, valid_for):
+    """Build a feespasses table row from an entrance fee or pass record"""
+    item_get = item.get
+    return {
+        "pass_id": item_get("id", "Unknown ID"),
+        "park_id": park_id,
+        "park_name": park_name,
+        "title": item_get("title", "No Title"),
+        "cost": to_float(item_get("cost")) or 0.0,
+        "description": item_get("description", ""),
+        "valid_for": valid_for
+    }
+
+def build_thingstodo_row(park, activity):
+    """Build a thingstodo table row from an NPS activity and its park"""
+    activity_get = activity.get
+    park_get = park.get
+    tags = activity_get("tags")
+    return {
+        "activity_id": activity_get("id", "Unknown ID"),
+        "park_id": park_get("id", "Unknown ID"),
+        "park_name": park_get("fullName", "Unknown Park"),
+        "park_state": park_get("states", ""),
+        "title": activity_get("title", "No Title"),
+        "short_description": activity_get("shortDescription", ""),
+        "accessibility_information": activity_get("accessibilityInformation", ""),
+        "location": activity_get("location", ""),
+        "url": activity_get("url", ""),
+        "duration": activity_get("duration", ""),
+        "tags": json.dumps(tags) if tags else EMPTY_JSON_LIST
+    }
+
+def upsert_in_batches(table, build_row, items, batch_size=UPSERT_BATCH_SIZE):
+    """Build rows a batch at a time, skipping records that fail to build, then emit their upserts"""
+    upsert = op.upsert
+    # Row failures are counted here and reported once after the loop
+    failed_rows = 0
+    for batch_start in range(0, len(items), batch_size):
+        rows = []
+        for item in items[batch_start:batch_start + batch_size]:
+            try:
+                rows.append(build_row(*item))
+            except Exception:
+                failed_rows += 1
+        for row in rows:
+            yield upsert(table=table, data=row)
+
+    if failed_rows:
+        Logging.warning(f"{failed_rows} {table} rows failed to process")
 
 def update(configuration: dict, state: dict):
     """Retrieve data from the NPS API."""
-    session = create_retry_session()
+    # Local alias avoids a global + attribute lookup per emitted row
+    upsert = op.upsert
     try:
         API_KEY = get_api_key(configuration)
         BASE_URL = "https://developer.nps.gov/api/v1"
         
-        # List of all National Park codes
-        park_codes = [
-            'acad', 'arch', 'badl', 'bibe', 'bisc', 'blca', 'brca', 'cany', 'care', 'cave',
-            'chis', 'coga', 'crla', 'cuva', 'dena', 'deva', 'drto', 'ever', 'gaar', 'glac',
-            'glba', 'grba', 'grca', 'grsm', 'grte', 'gumo', 'hale', 'havo', 'hosp', 'isro',
-            'jeff', 'jotr', 'kefj', 'kova', 'lacl', 'lavo', 'maca', 'meve', 'mora', 'noca',
-            'npsa', 'olym', 'pefo', 'pinn', 'redw', 'romo', 'sagu', 'seki', 'shen', 'thro',
-            'voya', 'wica', 'wrst', 'yell', 'yose', 'zion'
-        ]
-        
-        # Get all National Parks using individual requests
+        # Fetch all parks and things to do in bulk
         Logging.warning("Starting main parks sync")
-        all_parks = []
-        
-        # Request each park individually
-        for park_code in park_codes:
-            base_params = {
-                "api_key": API_KEY,
-                "parkCode": park_code
-            }
-            
-            Logging.warning(f"Requesting park with code: {park_code}")
-            parks_response = make_api_request(session, f"{BASE_URL}/parks", base_params)
-            parks_data = parks_response.get("data", [])
-            
-            for park in parks_data:
-                designation = park.get("designation", "")
-                # Include variations of National Park designations
-                if (designation == "National Park" or
-                    designation == "National Park & Preserve" or
-                    designation == "National Parks" or
-                    "National Park" in designation):  # This will catch combined designations
-                    all_parks.append(park)
-                    Logging.warning(f"Found National Park: {park.get('fullName')} | State(s): {park.get('states', 'N/A')} | Designation: {designation}")
-            
-            # Small delay to be nice to the API
-            time.sleep(0.1)
+        all_parks, activities = asyncio.run(collect_nps_data(BASE_URL, API_KEY))
         
         Logging.warning(f"Final count of National Parks: {len(all_parks)}")
         
-        # Process parks
-        for park in all_parks:
-            try:
-                yield op.upsert(
-                    table="parks",
-                    data={
-                        "park_id": park.get("id", "Unknown ID"),
-                        "name": park.get("fullName", "No Name"),
-                        "description": park.get("description", "No Description"),
-                        "state": park.get("states", ""),
-                        "latitude": float(park.get("latitude")) if park.get("latitude") else None,
-                        "longitude": float(park.get("longitude")) if park.get("longitude") else None,
-                        "activities": json.dumps([activity["name"] for activity in park.get("activities", [])]),
-                        "designation": park.get("designation", "")
-                    }
-                )
-            except Exception as e:
-                Logging.warning(f"Error processing park {park.get('id', 'Unknown')}: {str(e)}")
-                continue
-
-        # Sync fees/passes for National Parks
-        Logging.warning("Starting fees/passes sync")
-        for park in all_parks:
-            park_id = park.get("id", "Unknown ID")
-            park_name = park.get("fullName", "Unknown Park")
-            
-            # Process entrance fees
-            for fee in park.get("entranceFees", []):
-                try:
-                    yield op.upsert(
-                        table="feespasses",
-                        data={
-                            "pass_id": fee.get("id", "Unknown ID"),
-                            "park_id": park_id,
-                            "park_name": park_name,
-                            "title": fee.get("title", "No Title"),
-                            "cost": float(fee.get("cost", 0)),
-                            "description": fee.get("description", ""),
-                            "valid_for": "Fee"
-                        }
-                    )
-                except Exception as e:
-                    Logging.warning(f"Error processing fee for park {park_id}: {str(e)}")
-                    continue
-
-            # Process entrance passes
-            for pass_item in park.get("entrancePasses", []):
+        # A previous sync that was interrupted after checkpointing parks and fees/passes resumes at things to do
+        if state.get("parks_synced"):
+            Logging.warning("Parks and fees/passes were synced by the interrupted previous run, skipping to things to do")
+            park_by_code = {park.get("parkCode"): park for park in all_parks}
+        else:
+            # Process parks along with their fees/passes, which are already part of the /parks response,
+            # and build the park code lookup for things to do in the same pass
+            Logging.warning("Starting parks and fees/passes sync")
+            park_by_code = {}
+            # Row failures are counted here and reported once after the loop
+            failed_parks = 0
+            failed_feespasses = 0
+            for park in all_parks:
+                park_id = park.get("id", "Unknown ID")
+                park_name = park.get("fullName", "Unknown Park")
+                park_by_code[park.get("parkCode")] = park
+
                 try:
-                    yield op.upsert(
-                        table="feespasses",
-                        data={
-                            "pass_id": pass_item.get("id", "Unknown ID"),
-                            "park_id": park_id,
-                            "park_name": park_name,
-                            "title": pass_item.get("title", "No Title"),
-                            "cost": float(pass_item.get("cost", 0)),
-                            "description": pass_item.get("description", ""),
-                            "valid_for": "Pass"
-                        }
-                    )
-                except Exception as e:
-                    Logging.warning(f"Error processing pass for park {park_id}: {str(e)}")
-                    continue
+                    yield upsert(table="parks", data=build_park_row(park))
+                except Exception:
+                    failed_parks += 1
+
+                # Process entrance fees and passes
+                for valid_for, items in (("Fee", park.get("entranceFees", [])),
+                                         ("Pass", park.get("entrancePasses", []))):
+                    for item in items:
+                        try:
+                            yield upsert(table="feespasses", data=build_feespass_row(item, park_id, park_name, valid_for))
+                        except Exception:
+                            failed_feespasses += 1
+                            continue
+
+            if failed_parks or failed_feespasses:
+                Logging.warning(f"{failed_parks} parks rows and {failed_feespasses} feespasses rows failed to process")
+
+            # Checkpoint so a failure during things to do does not redo the parks and fees/passes upserts
+            yield op.checkpoint(state={"parks_synced": True})
 
         # Sync things to do for National Parks
         Logging.warning("Starting things to do sync")
-        for park in all_parks:
-            park_id = park.get("id", "Unknown ID")
-            params = {
-                "api_key": API_KEY,
-                "parkCode": park.get("parkCode")
-            }
-            
-            thingstodo_response = make_api_request(session, f"{BASE_URL}/thingstodo", params)
-            for activity in thingstodo_response.get("data", []):
-                try:
-                    yield op.upsert(
-                        table="thingstodo",
-                        data={
-                            "activity_id": activity.get("id", "Unknown ID"),
-                            "park_id": park_id,
-                            "park_name": park.get("fullName", "Unknown Park"),
-                            "park_state": park.get("states", ""),
-                            "title": activity.get("title", "No Title"),
-                            "short_description": activity.get("shortDescription", ""),
-                            "accessibility_information": activity.get("accessibilityInformation", ""),
-                            "location": activity.get("location", ""),
-                            "url": activity.get("url", ""),
-                            "duration": activity.get("duration", ""),
-                            "tags": json.dumps(activity.get("tags", []))
-                        }
-                    )
-                except Exception as e:
-                    Logging.warning(f"Error processing activity for park {park_id}: {str(e)}")
-                    continue
-            
-            time.sleep(0.1)  # Small delay between parks
+        park_activities = join_things_to_do(park_by_code, activities)
+        yield from upsert_in_batches("thingstodo", build_thingstodo_row, park_activities)
 
+        # Sync complete, so the next run starts from the beginning
         yield op.checkpoint(state={})
 
     except Exception as e:
@@ -28,7 +28,8 @@ st.set_page_config(
 # Get Snowflake session
 session = get_active_session()
 
-# Load data functions
+# Load data functions (results are cached for 10 minutes so reruns do not query Snowflake again)
+@st.cache_data(ttl=600, show_spinner=False)
 def load_daily_activity():
     return session.sql("""
         SELECT 
@@ -40,19 +41,79 @@ def load_daily_activity():
         WHERE _FIVETRAN_DELETED = FALSE
     """).to_pandas()
 
+@st.cache_data(ttl=600, show_spinner=False)
 def load_daily_sleep():
+    # Sleep stage durations are converted from seconds to hours in Snowflake
     return session.sql("""
         SELECT 
             DATE, 
-            TOTAL_SLEEP_DURATION, 
-            DEEP_SLEEP_DURATION, 
-            LIGHT_SLEEP_DURATION, 
-            REM_SLEEP_DURATION, 
+            DEEP_SLEEP_DURATION / 3600.0 AS DEEP_SLEEP_HOURS, 
+            LIGHT_SLEEP_DURATION / 3600.0 AS LIGHT_SLEEP_HOURS, 
+            REM_SLEEP_DURATION / 3600.0 AS REM_SLEEP_HOURS, 
             SLEEP_EFFICIENCY
         FROM daily_sleep
         WHERE _FIVETRAN_DELETED = FALSE
     """).to_pandas()
 
+# Summary metrics are aggregated in Snowflake so only one row is transferred
+@st.cache_data(ttl=600, show_spinner=False)
+def load_activity_metrics():
+    return session.sql("""
+        SELECT 
+            COALESCE(SUM(STEPS), 0) AS TOTAL_STEPS, 
+            MAX(STEPS) AS BEST_STEPS, 
+            AVG(STEPS)::FLOAT AS AVG_STEPS, 
+            COALESCE(SUM(TOTAL_CALORIES), 0) AS TOTAL_CALORIES, 
+            MAX(ACTIVE_CALORIES) AS BEST_ACTIVE_CALORIES, 
+            AVG(ACTIVE_CALORIES)::FLOAT AS AVG_ACTIVE_CALORIES
+        FROM daily_activity
+        WHERE _FIVETRAN_DELETED = FALSE
+    """).to_pandas().iloc[0]
+
+@st.cache_data(ttl=600, show_spinner=False)
+def load_sleep_metrics():
+    # Per-day averages and maximums first, then averaged/maximized across days
+    return session.sql("""
+        WITH per_day AS (
+            SELECT 
+                DATE, 
+                AVG(TOTAL_SLEEP_DURATION) / 3600.0 AS AVG_TOTAL_SLEEP_HOURS, 
+                MAX(TOTAL_SLEEP_DURATION) / 3600.0 AS MAX_TOTAL_SLEEP_HOURS, 
+                AVG(DEEP_SLEEP_DURATION) / 3600.0 AS AVG_DEEP_SLEEP_HOURS, 
+                MAX(DEEP_SLEEP_DURATION) / 3600.0 AS MAX_DEEP_SLEEP_HOURS, 
+                AVG(REM_SLEEP_DURATION) / 3600.0 AS AVG_REM_SLEEP_HOURS, 
+                MAX(REM_SLEEP_DURATION) / 3600.0 AS MAX_REM_SLEEP_HOURS, 
+                SUM(SLEEP_EFFICIENCY) AS SUM_EFFICIENCY, 
+                COUNT(SLEEP_EFFICIENCY) AS COUNT_EFFICIENCY
+            FROM daily_sleep
+            WHERE _FIVETRAN_DELETED = FALSE
+            GROUP BY DATE
+        )
+        SELECT 
+            AVG(AVG_TOTAL_SLEEP_HOURS)::FLOAT AS AVG_TOTAL_SLEEP_HOURS, 
+            MAX(MAX_TOTAL_SLEEP_HOURS)::FLOAT AS MAX_TOTAL_SLEEP_HOURS, 
+            AVG(AVG_DEEP_SLEEP_HOURS)::FLOAT AS AVG_DEEP_SLEEP_HOURS, 
+            MAX(MAX_DEEP_SLEEP_HOURS)::FLOAT AS MAX_DEEP_SLEEP_HOURS, 
+            AVG(AVG_REM_SLEEP_HOURS)::FLOAT AS AVG_REM_SLEEP_HOURS, 
+            MAX(MAX_REM_SLEEP_HOURS)::FLOAT AS MAX_REM_SLEEP_HOURS, 
+            (SUM(SUM_EFFICIENCY) / NULLIF(SUM(COUNT_EFFICIENCY), 0) * 100)::FLOAT AS AVG_EFFICIENCY
+        FROM per_day
+    """).to_pandas().iloc[0]
+
+@st.cache_data(ttl=3600, show_spinner=False)
+def cortex_complete(model_name, prompt):
+    """
+    Runs a Cortex completion, cached per model and prompt so repeated runs on unchanged data skip the LLM call.
+    """
+    query = """
+    SELECT SNOWFLAKE.CORTEX.COMPLETE(
+        ?,
+        ?
+    ) AS response
+    """
+    result = session.sql(query, params=[model_name, prompt]).collect()
+    return result[0]["RESPONSE"] if result else None
+
 def generate_ai_analysis(activity_summary, sleep_summary, model_name):
     """
     Uses Snowflake Cortex to generate AI-driven insights with structured analysis.
@@ -89,14 +150,7 @@ def generate_ai_analysis(activity_summary, sleep_summary, model_name):
     🔹 85% - Based on historical trends and scientific correlations.
     """
 
-    query = """
-    SELECT SNOWFLAKE.CORTEX.COMPLETE(
-        ?,
-        ?
-    ) AS response
-    """
-    result = session.sql(query, params=[model_name, cortex_prompt]).collect()
-    return result[0]["RESPONSE"] if result else "No response generated."
+    return cortex_complete(model_name, cortex_prompt) or "No response generated."
 
 
 # Load data
@@ -104,6 +158,8 @@ try:
     with st.spinner("Loading Oura data..."):
         activity_data = load_daily_activity()
         sleep_data = load_daily_sleep()
+        activity_metrics = load_activity_metrics()
+        sleep_metrics = load_sleep_metrics()
 
     # Dashboard Title
     # Imgur-hosted Oura logo (Replace with your actual Imgur image URL)
@@ -127,13 +183,13 @@ try:
     with tab1:
         st.header("🏃 Daily Activity Overview")
 
-        # Calculate key metrics
-        total_steps = activity_data["STEPS"].sum()
-        best_steps = activity_data["STEPS"].max()
-        avg_steps = activity_data["STEPS"].mean()
-        total_calories = activity_data["TOTAL_CALORIES"].sum()
-        best_active_calories = activity_data["ACTIVE_CALORIES"].max()
-        avg_active_calories = activity_data["ACTIVE_CALORIES"].mean()
+        # Key metrics (aggregated in Snowflake)
+        total_steps = activity_metrics["TOTAL_STEPS"]
+        best_steps = activity_metrics["BEST_STEPS"]
+        avg_steps = activity_metrics["AVG_STEPS"]
+        total_calories = activity_metrics["TOTAL_CALORIES"]
+        best_active_calories = activity_metrics["BEST_ACTIVE_CALORIES"]
+        avg_active_calories = activity_metrics["AVG_ACTIVE_CALORIES"]
 
         # Display Metrics
         st.markdown("### **Key Activity Metrics**")
@@ -173,14 +229,11 @@ try:
 
         # Calories Breakdown
         st.subheader("🔥 Calories Breakdown")
-        activity_data_melted = activity_data.melt(
-            id_vars=["DATE"],
-            value_vars=["TOTAL_CALORIES", "ACTIVE_CALORIES"],
-            var_name="Calorie Type",
-            value_name="Calories"
-        )
-
-        calorie_chart = alt.Chart(activity_data_melted).mark_bar().encode(
+        # Fold the calorie columns into long form in the chart spec instead of melting the DataFrame
+        calorie_chart = alt.Chart(activity_data).transform_fold(
+            ["TOTAL_CALORIES", "ACTIVE_CALORIES"],
+            as_=["Calorie Type", "Calories"]
+        ).mark_bar().encode(
             x=alt.X("DATE:T", title="Date"),
             y=alt.Y("Calories:Q", title="Calories Burned"),
             color=alt.Color("Calorie Type:N", scale=alt.Scale(scheme="dark2")),
@@ -193,30 +246,17 @@ try:
     with tab2:
         st.header("😴 Sleep Patterns & Quality")
 
-        # Calculate Daily Sleep Metrics
-        # Convert duration columns from seconds to hours
-        sleep_data["TOTAL_SLEEP_HOURS"] = sleep_data["TOTAL_SLEEP_DURATION"] / 3600
-        sleep_data["DEEP_SLEEP_HOURS"] = sleep_data["DEEP_SLEEP_DURATION"] / 3600
-        sleep_data["REM_SLEEP_HOURS"] = sleep_data["REM_SLEEP_DURATION"] / 3600
-
-        # Group by DATE to get correct per-day values
-        daily_sleep = sleep_data.groupby("DATE").agg({
-            "TOTAL_SLEEP_HOURS": ["mean", "max"],
-            "DEEP_SLEEP_HOURS": ["mean", "max"],
-            "REM_SLEEP_HOURS": ["mean", "max"]
-        })
+        # Daily Sleep Metrics (per-day values aggregated in Snowflake)
+        avg_total_sleep_per_day = sleep_metrics["AVG_TOTAL_SLEEP_HOURS"]
+        max_total_sleep_per_day = sleep_metrics["MAX_TOTAL_SLEEP_HOURS"]
 
-        # Extract values correctly (avoid applying .mean() twice)
-        avg_total_sleep_per_day = daily_sleep["TOTAL_SLEEP_HOURS"]["mean"].mean()
-        max_total_sleep_per_day = daily_sleep["TOTAL_SLEEP_HOURS"]["max"].max()
+        avg_deep_sleep_per_day = sleep_metrics["AVG_DEEP_SLEEP_HOURS"]
+        max_deep_sleep_per_day = sleep_metrics["MAX_DEEP_SLEEP_HOURS"]
 
-        avg_deep_sleep_per_day = daily_sleep["DEEP_SLEEP_HOURS"]["mean"].mean()
-        max_deep_sleep_per_day = daily_sleep["DEEP_SLEEP_HOURS"]["max"].max()
+        avg_rem_sleep_per_day = sleep_metrics["AVG_REM_SLEEP_HOURS"]
+        max_rem_sleep_per_day = sleep_metrics["MAX_REM_SLEEP_HOURS"]
 
-        avg_rem_sleep_per_day = daily_sleep["REM_SLEEP_HOURS"]["mean"].mean()
-        max_rem_sleep_per_day = daily_sleep["REM_SLEEP_HOURS"]["max"].max()
-
-        avg_efficiency = sleep_data["SLEEP_EFFICIENCY"].mean() * 100
+        avg_efficiency = sleep_metrics["AVG_EFFICIENCY"]
 
         # Display Sleep Metrics
         st.markdown("### **Key Sleep Metrics (Per Day)**")
@@ -254,22 +294,12 @@ try:
 
         st.altair_chart(efficiency_chart, use_container_width=True)
 
-        # Convert sleep stage durations from seconds to hours
-        sleep_data["DEEP_SLEEP_HOURS"] = sleep_data["DEEP_SLEEP_DURATION"] / 3600
-        sleep_data["LIGHT_SLEEP_HOURS"] = sleep_data["LIGHT_SLEEP_DURATION"] / 3600
-        sleep_data["REM_SLEEP_HOURS"] = sleep_data["REM_SLEEP_DURATION"] / 3600
-
-        # Melt the DataFrame for Altair visualization
-        sleep_data_melted = sleep_data.melt(
-            id_vars=["DATE"],
-            value_vars=["DEEP_SLEEP_HOURS", "LIGHT_SLEEP_HOURS", "REM_SLEEP_HOURS"],
-            var_name="Sleep Stage",
-            value_name="Duration (hours)"
-        )
-
-        # Sleep Stages Over Time Chart (Now in Hours)
+        # Sleep Stages Over Time Chart (Now in Hours), folding the stage columns into long form in the chart spec
         st.subheader("💤 Sleep Stages Over Time (in Hours)")
-        sleep_chart = alt.Chart(sleep_data_melted).mark_area(opacity=0.7).encode(
+        sleep_chart = alt.Chart(sleep_data).transform_fold(
+            ["DEEP_SLEEP_HOURS", "LIGHT_SLEEP_HOURS", "REM_SLEEP_HOURS"],
+            as_=["Sleep Stage", "Duration (hours)"]
+        ).mark_area(opacity=0.7).encode(
             x=alt.X("DATE:T", title="Date"),
             y=alt.Y("Duration (hours):Q", title="Sleep Duration (hours)"),
             color=alt.Color("Sleep Stage:N", scale=alt.Scale(scheme="viridis")),
@@ -346,14 +376,7 @@ try:
                     Ensure the forecast is realistic and follows prior trends.
                     """
     
-                    query = """
-                    SELECT SNOWFLAKE.CORTEX.COMPLETE(
-                        ?,
-                        ?
-                    ) AS response
-                    """
-                    result = session.sql(query, params=[model_name, forecast_prompt]).collect()
-                    forecast_response = result[0]["RESPONSE"] if result else "No response generated."
+                    forecast_response = cortex_complete(model_name, forecast_prompt) or "No response generated."
                     st.markdown(f"**📈 Health Forecast Summary:**\n\n{forecast_response}")
     
                 elif selected_app == "🚨 Cortex-Detected Health Anomalies":
@@ -381,14 +404,7 @@ try:
                     - **Sleep Summary**: {sleep_summary}
                     """
     
-                    query = """
-                    SELECT SNOWFLAKE.CORTEX.COMPLETE(
-                        ?,
-                        ?
-                    ) AS response
-                    """
-                    result = session.sql(query, params=[model_name, anomaly_prompt]).collect()
-                    anomaly_response = result[0]["RESPONSE"] if result else "No anomalies detected."
+                    anomaly_response = cortex_complete(model_name, anomaly_prompt) or "No anomalies detected."
                     st.markdown(f"**⚠️ Health Findings:**\n\n{anomaly_response}")
 
 except Exception as e:
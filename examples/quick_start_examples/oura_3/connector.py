@@ -1,24 +1,116 @@
+import asyncio
+import atexit
 import json
-import time
-from datetime import datetime, timedelta
-import requests as rq
-from requests.adapters import HTTPAdapter
-from urllib3.util.retry import Retry
+import os
+from datetime import date, datetime
+import aiohttp
 from fivetran_connector_sdk import Connector
 from fivetran_connector_sdk import Logging
 from fivetran_connector_sdk import Operations as op
 
+# Prefer orjson for faster JSON parsing/serialization, fall back to the stdlib
+try:
+    import orjson
+
+    json_loads = orjson.loads
+
+    def json_dumps_indented(value):
+        """Serialize a value to an indented JSON string with orjson"""
+        return orjson.dumps(value, option=orjson.OPT_INDENT_2).decode()
+except ImportError:
+    json_loads = json.loads
+
+    def json_dumps_indented(value):
+        """Serialize a value to an indented JSON string"""
+        return json.dumps(value, indent=2)
+
+BASE_URL = "https://api.ouraring.com/v2"
+REQUEST_TIMEOUT = 30
+
+# Connection pool for the single Oura host; idle connections are kept alive between requests
+MAX_CONNECTIONS = 8
+KEEPALIVE_TIMEOUT = 60
+
+# Retry settings for transient failures (the Oura limit is 5,000 requests per 5 minutes)
+MAX_RETRIES = 5
+BACKOFF_FACTOR = 2
+RETRY_STATUS_CODES = {408, 429, 500, 502, 503, 504}
+
+# Verbose per-record logging for troubleshooting (set OURA_DEBUG=1 to enable)
+OURA_DEBUG = bool(os.environ.get("OURA_DEBUG"))
+
+# Assumed base duration in seconds for 100% sleep score (8 hours)
+BASE_SLEEP_DURATION = 8 * 60 * 60
+
+# Columns copied from each record, per table: (source key, output column, cast, default).
+# The cast is None where the decoded JSON already has the column type; id keeps str() as it is the primary key.
+FIELD_SPECS = {
+    'daily_activity': (
+        ('id', 'id', str, ''),
+        ('steps', 'steps', None, 0),
+        ('total_calories', 'total_calories', None, 0),
+        ('active_calories', 'active_calories', None, 0)
+    ),
+    'daily_sleep': (
+        ('id', 'id', str, ''),
+    )
+}
+
 
-def create_retry_session():
-    """Create a requests session with retry logic"""
-    session = rq.Session()
-    retries = Retry(
-        total=5,
-        backoff_factor=2,
-        status_forcelist=[408, 429, 500, 502, 503, 504]
+def create_session(api_key):
+    """Create an aiohttp session with the Oura auth headers, a keep-alive connection pool and request timeout"""
+    # Ask for compressed JSON (aiohttp decompresses it transparently); GET requests carry no body, so no Content-Type
+    headers = {
+        "Authorization": f"Bearer {api_key}",
+        "Accept": "application/json",
+        "Accept-Encoding": "gzip, deflate"
+    }
+    return aiohttp.ClientSession(
+        base_url=f"{BASE_URL}/",
+        headers=headers,
+        connector=aiohttp.TCPConnector(
+            limit=MAX_CONNECTIONS,
+            limit_per_host=MAX_CONNECTIONS,
+            keepalive_timeout=KEEPALIVE_TIMEOUT
+        ),
+        timeout=aiohttp.ClientTimeout(total=REQUEST_TIMEOUT)
     )
-    session.mount('https://', HTTPAdapter(max_retries=retries))
-    return session
+
+
+# Event loop and session kept alive across update() calls so later syncs in the same process
+# reuse the pooled connections, DNS lookups and TLS sessions instead of setting them up again
+_LOOP = None
+_SESSION = None
+_SESSION_API_KEY = None
+
+
+async def open_session(api_key):
+    """Create the session inside the running loop, as aiohttp requires"""
+    return create_session(api_key)
+
+
+def close_session():
+    """Close the shared session and its event loop"""
+    global _SESSION
+    if _SESSION is not None and not _SESSION.closed:
+        _LOOP.run_until_complete(_SESSION.close())
+    _SESSION = None
+    if _LOOP is not None and not _LOOP.is_closed():
+        _LOOP.close()
+
+
+def get_session(api_key):
+    """Return the shared session, creating it on first use or when the API key changes"""
+    global _LOOP, _SESSION, _SESSION_API_KEY
+    if _LOOP is None:
+        _LOOP = asyncio.new_event_loop()
+        atexit.register(close_session)
+    if _SESSION is None or _SESSION.closed or _SESSION_API_KEY != api_key:
+        if _SESSION is not None and not _SESSION.closed:
+            _LOOP.run_until_complete(_SESSION.close())
+        _SESSION = _LOOP.run_until_complete(open_session(api_key))
+        _SESSION_API_KEY = api_key
+    return _SESSION
 
 
 def get_api_key(configuration):
@@ -29,147 +121,216 @@ def get_api_key(configuration):
     return str(api_key)
 
 
+# Table schemas, built once at import since they do not depend on the configuration
+SCHEMA = [
+    {
+        "table": "daily_activity",
+        "primary_key": ["id"],
+    },
+    {
+        "table": "daily_sleep",
+        "primary_key": ["id"],
+    }
+]
+
+
 def schema(configuration: dict):
     """Define the table schemas for Fivetran."""
-    return [
-        {
-            "table": "daily_activity",
-            "primary_key": ["id"],
-        },
-        {
-            "table": "daily_sleep",
-            "primary_key": ["id"],
-        }
-    ]
+    return SCHEMA
 
 
-def make_api_request(session, api_key, endpoint, params=None):
-    """Make API request with better error handling"""
-    base_url = "https://api.ouraring.com/v2"
+def retry_delay(retry_after, attempt):
+    """Seconds to wait before a retry: the server's Retry-After when it sends one, exponential backoff otherwise"""
+    if retry_after:
+        try:
+            return max(0, int(retry_after))
+        except ValueError:
+            pass
+    return BACKOFF_FACTOR * (2 ** attempt)
+
+
+async def make_api_request(session, endpoint, params=None):
+    """Make API request with retries and better error handling"""
+    for attempt in range(MAX_RETRIES + 1):
+        try:
+            async with session.get(endpoint, params=params) as response:
+                status = response.status
+                if status in RETRY_STATUS_CODES and attempt < MAX_RETRIES:
+                    retry_after = response.headers.get("Retry-After")
+                else:
+                    if status >= 400:
+                        Logging.warning(f"HTTP Error: {status} - {await response.text()}")
+                    response.raise_for_status()  # Raise an error for 4xx/5xx responses
+
+                    data = json_loads(await response.read())
+                    break
+
+            # Wait outside the request context so the pooled connection is released during the backoff
+            delay = retry_delay(retry_after, attempt)
+            Logging.warning(f"Status {status} from {endpoint}, retrying in {delay} seconds")
+            await asyncio.sleep(delay)
+        except (aiohttp.ClientConnectionError, asyncio.TimeoutError) as e:
+            if attempt == MAX_RETRIES:
+                Logging.warning(f"Unexpected error: {str(e)}")
+                raise
+            await asyncio.sleep(BACKOFF_FACTOR * (2 ** attempt))
+
+    record_count = len(data.get('data', []))
+    Logging.warning(f"Response from {endpoint} contains {record_count} records")
+
+    if OURA_DEBUG and record_count > 0:
+        sample_record = data['data'][0]
+        Logging.warning(f"Sample record structure: {json_dumps_indented(sample_record)}")
+
+    return data
 
-    headers = {
-        "Authorization": f"Bearer {api_key}",
-        "Content-Type": "application/json",
-        "Accept": "application/json"
-    }
 
+async def fetch_route_pages(session, endpoint, params):
+    """Fetch every page of a route by following next_token and return the pages in order"""
+    pages = []
+    page_params = params
+    while True:
+        data = await make_api_request(session, endpoint, page_params)
+        pages.append(data)
+        next_token = data.get('next_token')
+        if not next_token:
+            return pages
+        page_params = {**params, 'next_token': next_token}
+
+
+async def fetch_all_routes(session, routes, params):
+    """Fetch every route concurrently and return each route's pages in route order"""
+    return await asyncio.gather(
+        *(fetch_route_pages(session, route['endpoint'], params) for route in routes)
+    )
+
+
+def normalize_date(date_str):
+    """Return the YYYY-MM-DD part of a date or timestamp string, or None if it is not a valid date."""
+    if 'T' in date_str:
+        date_str = date_str.split('T')[0]  # Extract YYYY-MM-DD
+
+    # fromisoformat is much faster than strptime, and the shape check keeps it to YYYY-MM-DD
+    if len(date_str) != 10 or date_str[4] != '-' or date_str[7] != '-':
+        return None
     try:
-        url = f"{base_url}/{endpoint}"
-        response = session.get(url, headers=headers, params=params, timeout=30)
-        response.raise_for_status()  # Raise an error for 4xx/5xx responses
-        
-        data = response.json()
-        record_count = len(data.get('data', []))
-        Logging.warning(f"Response from {endpoint} contains {record_count} records")
-
-        if record_count > 0:
-            sample_record = data['data'][0]
-            Logging.warning(f"Sample record structure: {json.dumps(sample_record, indent=2)}")
-        
-        return data
-    except rq.exceptions.HTTPError as e:
-        Logging.warning(f"HTTP Error: {e.response.status_code} - {e.response.text}")
-        raise
-    except Exception as e:
-        Logging.warning(f"Unexpected error: {str(e)}")
-        raise
+        date.fromisoformat(date_str)
+    except ValueError:
+        return None
+    return date_str
+
+
+def build_row_builder(table, field_spec):
+    """Generate a straight-line function that copies a table's FIELD_SPECS columns out of a record."""
+    namespace = {}
+    columns = []
+    for index, (key, column, cast, default) in enumerate(field_spec):
+        if cast is None:
+            columns.append(f"{column!r}: get({key!r}, {default!r})")
+        else:
+            namespace[f'cast_{index}'] = cast
+            columns.append(f"{column!r}: cast_{index}(get({key!r}, {default!r}))")
+    source = f"def build_{table}_row(record):\n    get = record.get\n    return {{{', '.join(columns)}}}\n"
+    exec(source, namespace)
+    return namespace[f'build_{table}_row']
+
+
+# Row builders specialized to each table's field spec, so no per-field spec loop runs per record
+ROW_BUILDERS = {table: build_row_builder(table, field_spec) for table, field_spec in FIELD_SPECS.items()}
+
+
+def derive_sleep_durations(record):
+    """Estimate sleep durations and efficiency from the contributor scores of a sleep record."""
+    contributors = record.get('contributors') or {}
+
+    # Convert percentage scores to durations based on the base duration
+    total_sleep_score = contributors.get('total_sleep', 0) / 100.0
+    deep_sleep_score = contributors.get('deep_sleep', 0) / 100.0
+    rem_sleep_score = contributors.get('rem_sleep', 0) / 100.0
+
+    # Calculate durations in seconds
+    total_sleep_duration = int(BASE_SLEEP_DURATION * total_sleep_score)
+    deep_sleep_duration = int(BASE_SLEEP_DURATION * 0.25 * deep_sleep_score)  # Assume ideal deep sleep is 25% of total
+    rem_sleep_duration = int(BASE_SLEEP_DURATION * 0.25 * rem_sleep_score)    # Assume ideal REM is 25% of total
+    light_sleep_duration = total_sleep_duration - (deep_sleep_duration + rem_sleep_duration)
+
+    return {
+        'total_sleep_duration': total_sleep_duration,
+        'deep_sleep_duration': deep_sleep_duration,
+        'light_sleep_duration': max(0, light_sleep_duration),  # Ensure non-negative
+        'rem_sleep_duration': rem_sleep_duration,
+        # Calculate sleep efficiency from the efficiency score
+        'sleep_efficiency': contributors.get('efficiency', 0) / 100.0
+    }
+
+
+# Columns computed from a record rather than copied, per table
+DERIVED_FIELDS = {
+    'daily_sleep': derive_sleep_durations
+}
+
+
+# Record keys holding each table's date, in lookup order; daily_sleep keys on `day` so sleep
+# that crosses midnight keeps its primary key
+DATE_KEYS = {
+    'daily_sleep': ('day', 'timestamp')
+}
+DEFAULT_DATE_KEYS = ('date', 'timestamp', 'day')
 
 
-def process_daily_activity(data):
-    """Process daily activity data from the Oura API response."""
-    processed_records = []
-    
+def process_records(table, data):
+    """Yield rows for the given table from the records of an Oura API response."""
+    build_row = ROW_BUILDERS[table]
+    derive = DERIVED_FIELDS.get(table)
+    date_keys = DATE_KEYS.get(table, DEFAULT_DATE_KEYS)
+    processed_count = 0
+    # Sync time shared by every record in this batch
+    last_modified = datetime.utcnow().isoformat()
+    validated_dates = {}
+    # Skipped records are counted here and reported once after the loop
+    skipped_records = 0
+
     for record in data.get('data', []):
-        date_str = record.get('date') or record.get('timestamp') or record.get('day')
+        date_str = next(filter(None, map(record.get, date_keys)), None)
 
         if not date_str:
-            Logging.warning(f"Skipping record with missing date: {record.get('id', 'unknown id')}")
+            skipped_records += 1
+            if OURA_DEBUG:
+                Logging.warning(f"Skipping {table} record with missing date: {record.get('id', 'unknown id')}")
             continue
 
-        try:
-            if 'T' in date_str:
-                date_str = date_str.split('T')[0]  # Extract YYYY-MM-DD
-            
-            datetime.strptime(date_str, '%Y-%m-%d')  # Validate date format
-        except ValueError:
-            Logging.warning(f"Invalid date format: {date_str}")
+        # Repeated date strings in the batch reuse the first validation result
+        if date_str not in validated_dates:
+            validated_dates[date_str] = normalize_date(date_str)
+        normalized_date = validated_dates[date_str]
+        if normalized_date is None:
+            skipped_records += 1
+            if OURA_DEBUG:
+                Logging.warning(f"Invalid date format: {date_str}")
             continue
 
-        processed_record = {
-            'id': str(record.get('id', '')),
-            'date': date_str,
-            'steps': int(record.get('steps', 0)),
-            'total_calories': int(record.get('total_calories', 0)),
-            'active_calories': int(record.get('active_calories', 0)),
-            'last_modified': datetime.utcnow().isoformat()
-        }
-        processed_records.append(processed_record)
-
-    return processed_records
-
-
-def process_sleep_data(data):
-    """Process daily sleep data from the Oura API response."""
-    processed_records = []
-    
-    # Assumed base duration in seconds for 100% score (8 hours)
-    BASE_SLEEP_DURATION = 8 * 60 * 60  # 8 hours in seconds
-    
-    if not data or 'data' not in data:
-        Logging.warning("No data available to process")
-        return processed_records
-    
-    for record in data.get('data', []):
         try:
-            Logging.warning(f"Processing sleep record: {json.dumps(record, indent=2)}")
-            
-            date_str = record.get('day')
-            if not date_str:
-                Logging.warning(f"Skipping sleep record with missing date")
-                continue
-                
-            contributors = record.get('contributors', {})
-            
-            # Convert percentage scores to durations based on the base duration
-            total_sleep_score = contributors.get('total_sleep', 0) / 100.0
-            deep_sleep_score = contributors.get('deep_sleep', 0) / 100.0
-            rem_sleep_score = contributors.get('rem_sleep', 0) / 100.0
-            
-            # Calculate durations in seconds
-            total_sleep_duration = int(BASE_SLEEP_DURATION * total_sleep_score)
-            deep_sleep_duration = int(BASE_SLEEP_DURATION * 0.25 * deep_sleep_score)  # Assume ideal deep sleep is 25% of total
-            rem_sleep_duration = int(BASE_SLEEP_DURATION * 0.25 * rem_sleep_score)    # Assume ideal REM is 25% of total
-            light_sleep_duration = total_sleep_duration - (deep_sleep_duration + rem_sleep_duration)
-            
-            # Calculate sleep efficiency from the efficiency score
-            sleep_efficiency = contributors.get('efficiency', 0) / 100.0
-            
-            processed_record = {
-                'id': str(record.get('id', '')),
-                'date': date_str,
-                'total_sleep_duration': total_sleep_duration,
-                'deep_sleep_duration': deep_sleep_duration,
-                'light_sleep_duration': max(0, light_sleep_duration),  # Ensure non-negative
-                'rem_sleep_duration': rem_sleep_duration,
-                'sleep_efficiency': sleep_efficiency,
-                'last_modified': datetime.utcnow().isoformat()
-            }
-            
-            Logging.warning(f"Processed sleep record: {json.dumps(processed_record, indent=2)}")
-            processed_records.append(processed_record)
-            
-        except Exception as e:
-            Logging.warning(f"Error processing sleep record: {str(e)}")
+            processed_record = build_row(record)
+            if derive is not None:
+                processed_record.update(derive(record))
+        except (AttributeError, TypeError, ValueError) as e:
+            skipped_records += 1
+            if OURA_DEBUG:
+                Logging.warning(f"Error processing {table} record: {str(e)}")
             continue
-    
-    Logging.warning(f"Successfully processed {len(processed_records)} sleep records")
-    return processed_records
+
+        processed_record['date'] = normalized_date
+        processed_record['last_modified'] = last_modified
+        processed_count += 1
+        yield processed_record
+
+    if skipped_records:
+        Logging.warning(f"Skipped {skipped_records} {table} records with a missing or invalid date or value")
+    Logging.warning(f"Processed {processed_count} records for {table}")
 
 
 def update(configuration: dict, state: dict):
     """Retrieve the most recent data from the Oura API."""
-    session = create_retry_session()
-
     try:
         api_key = get_api_key(configuration)
 
@@ -183,40 +344,36 @@ def update(configuration: dict, state: dict):
         routes = [
             {
                 'endpoint': 'usercollection/daily_activity',
-                'table': 'daily_activity',
-                'processor': process_daily_activity
+                'table': 'daily_activity'
             },
             {
                 'endpoint': 'usercollection/daily_sleep',
-                'table': 'daily_sleep',
-                'processor': process_sleep_data
+                'table': 'daily_sleep'
             }
         ]
 
-        for route in routes:
-            Logging.warning(f"Starting sync for {route['table']}")
-
-            params = {
-                'start_date': start_date,
-                'end_date': end_date
-            }
+        params = {
+            'start_date': start_date,
+            'end_date': end_date
+        }
 
-            try:
-                # Make API request
-                data = make_api_request(session, api_key, route['endpoint'], params)
-                processed_records = route['processor'](data)
+        # Fetch all routes concurrently so pages of different routes are fetched at the same time,
+        # on the shared loop and session kept open between syncs
+        session = get_session(api_key)
+        responses = _LOOP.run_until_complete(fetch_all_routes(session, routes, params))
 
-                # Process and upsert records
-                for record in processed_records:
-                    yield op.upsert(
-                        table=route['table'],
-                        data=record
-                    )
+        upsert = op.upsert
+        for route, pages in zip(routes, responses):
+            table = route['table']
+            Logging.warning(f"Starting sync for {table} ({len(pages)} pages)")
 
-                Logging.warning(f"Processed {len(processed_records)} records for {route['table']}")
+            try:
+                # Upsert each row as it is built instead of collecting the table's rows first
+                for data in pages:
+                    yield from (upsert(table=table, data=record) for record in process_records(table, data))
 
             except Exception as e:
-                Logging.warning(f"Error processing {route['table']}: {str(e)}")
+                Logging.warning(f"Error processing {table}: {str(e)}")
                 raise
 
         # Checkpoint after successful sync
@@ -235,5 +392,10 @@ connector = Connector(update=update, schema=schema)
 
 if __name__ == "__main__":
     Logging.warning("Starting Oura Ring connector debug run...")
-    connector.debug()
+    if os.environ.get("OURA_PROFILE"):
+        # Profile the debug run to find the slowest calls (set OURA_PROFILE=1 to enable)
+        import cProfile
+        cProfile.run("connector.debug()", sort="cumulative")
+    else:
+        connector.debug()
     Logging.warning("Debug run complete.")
@@ -1,9 +1,111 @@
 from fivetran_connector_sdk import Connector, Operations as op, Logging as log
 import requests
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
 from datetime import datetime, timedelta
 import time
+import queue
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from functools import partial
 from urllib.parse import urljoin
 
+# Prefer orjson for faster JSON parsing straight from the response bytes, fall back to the stdlib
+try:
+    from orjson import loads as json_loads
+except ImportError:
+    from json import loads as json_loads
+
+def create_session():
+    """Create a keep-alive session that pools connections to the Oura API and retries transient errors"""
+    session = requests.Session()
+    # Bounded retries with exponential backoff; 429s wait for the Retry-After the API sends
+    retries = Retry(
+        total=5,
+        backoff_factor=1,
+        status_forcelist=[429, 500, 502, 503, 504],
+        allowed_methods=["GET"],
+        respect_retry_after_header=True,
+        raise_on_status=False
+    )
+    adapter = HTTPAdapter(max_retries=retries, pool_connections=4, pool_maxsize=16)
+    session.mount("https://", adapter)
+    session.mount("http://", adapter)
+    return session
+
+# Shared across pages, tables and update() calls so the TCP/TLS connection is reused
+_SESSION = create_session()
+
+# Pause before the next request once the API reports this many requests or fewer left in the window
+RATE_LIMIT_MIN_REMAINING = 1
+
+# Reset header values above this are epoch timestamps (about 2001-09-09); smaller ones are seconds to wait
+RATE_LIMIT_EPOCH_THRESHOLD = 1e9
+
+def wait_for_rate_limit(response):
+    """Sleep until the rate limit window resets when the response reports the request budget is used up"""
+    remaining = response.headers.get('X-RateLimit-Remaining')
+    reset = response.headers.get('X-RateLimit-Reset')
+    if remaining is None or reset is None:
+        return
+    try:
+        if int(remaining) > RATE_LIMIT_MIN_REMAINING:
+            return
+        reset = float(reset)
+    except ValueError:
+        return
+
+    # The reset header is either an epoch timestamp or a number of seconds until the window resets;
+    # anything past RATE_LIMIT_EPOCH_THRESHOLD is an epoch, which may already have passed
+    if reset > RATE_LIMIT_EPOCH_THRESHOLD:
+        delay = max(0, reset - time.time())
+    else:
+        delay = reset
+    if delay > 0:
+        log.warning(f"Rate limit budget used up, waiting {delay:.0f} seconds for the window to reset")
+        time.sleep(delay)
+
+class TokenBucket:
+    """Client-side token bucket that holds requests back just long enough to stay within the API quota"""
+
+    def __init__(self, capacity, refill_rate):
+        self.capacity = capacity
+        self.refill_rate = refill_rate  # tokens added per second
+        self.tokens = capacity
+        self.last = time.monotonic()
+        self.lock = threading.Lock()  # shared by the per-table fetch threads
+
+    def acquire(self):
+        """Take one token, sleeping only for the deficit when the bucket is empty"""
+        with self.lock:
+            now = time.monotonic()
+            self.tokens = min(self.capacity, self.tokens + (now - self.last) * self.refill_rate)
+            self.last = now
+            if self.tokens < 1:
+                time.sleep((1 - self.tokens) / self.refill_rate)
+                self.tokens = 1
+                self.last = time.monotonic()
+            self.tokens -= 1
+
+# Oura allows 5000 requests per 5 minute window
+RATE_LIMITER = TokenBucket(capacity=5000, refill_rate=5000 / 300)
+
+# Format of the last sync timestamps kept in state, and of the dates the API expects
+TIMESTAMP_FORMAT = "%Y-%m-%dT%H:%M:%SZ"
+DATE_FORMAT = "%Y-%m-%d"
+
+# Days covered by each date range request; the ranges of a table are fetched in parallel
+RANGE_DAYS = 30
+
+# Concurrent page walks across all tables and date ranges, within the session's connection pool
+MAX_WORKERS = 4
+
+# Synced tables and the label used for them in log messages
+TABLES = {
+    "daily_activity": "daily activity",
+    "daily_sleep": "daily sleep"
+}
+
 def schema(configuration: dict):
     """Define the table schema for Fivetran"""
     return [
@@ -27,193 +129,136 @@ def update(configuration: dict, state: dict):
 
     base_url = configuration.get('base_url', 'https://api.ouraring.com/v2/')
 
-    # Set up headers with authentication
-    headers = {
+    # Set up headers with authentication on the shared session
+    _SESSION.headers.update({
         'Authorization': f'Bearer {api_token}',
         'Content-Type': 'application/json'
-    }
+    })
 
     # Get last sync timestamps for each endpoint or use default
     default_start_date = "2025-03-01T00:00:00Z"  # March 1, 2025
 
     # Use the state to track last sync dates per table
-    daily_activity_last_sync = state.get('daily_activity_last_sync', default_start_date)
-    daily_sleep_last_sync = state.get('daily_sleep_last_sync', default_start_date)
+    sync_state = {
+        'daily_activity_last_sync': state.get('daily_activity_last_sync', default_start_date),
+        'daily_sleep_last_sync': state.get('daily_sleep_last_sync', default_start_date)
+    }
 
     # Current time to use for this sync's state update
-    current_time = datetime.utcnow().strftime("%Y-%m-%dT%H:%M:%SZ")
-
-    # Sync daily activity data
-    yield from sync_daily_activity(base_url, headers, daily_activity_last_sync, current_time)
-
-    # Checkpoint after activity sync
-    yield op.checkpoint({"daily_activity_last_sync": current_time})
-
-    # Sync daily sleep data
-    yield from sync_daily_sleep(base_url, headers, daily_sleep_last_sync, current_time)
-
-    # Final checkpoint after all syncs
-    yield op.checkpoint({"daily_sleep_last_sync": current_time})
-
-
-def sync_daily_activity(base_url, headers, last_sync, current_time):
-    """Sync daily activity data from Oura API"""
-    log.info(f"Syncing daily activity data since {last_sync}")
-
-    # Convert datetime strings to date strings for API
-    start_date = datetime.strptime(last_sync, "%Y-%m-%dT%H:%M:%SZ").strftime("%Y-%m-%d")
-    end_date = datetime.strptime(current_time, "%Y-%m-%dT%H:%M:%SZ").strftime("%Y-%m-%d")
-
-    endpoint = "usercollection/daily_activity"
-    url = urljoin(base_url, endpoint)
-
-    next_token = None
-    page_count = 0
-    last_checkpoint_time = time.time()
-
-    while True:
-        try:
-            params = {
-                "start_date": start_date,
-                "end_date": end_date
-            }
-
-            if next_token:
-                params["next_token"] = next_token
-
-            log.info(f"Requesting daily activity data: {url} with params: {params}")
-            response = requests.get(url, headers=headers, params=params)
-
-            # Handle potential rate limiting
-            if response.status_code == 429:
-                retry_after = int(response.headers.get('Retry-After', 60))
-                log.warning(f"Rate limited. Waiting for {retry_after} seconds")
-                time.sleep(retry_after)
+    now = datetime.utcnow()
+    current_time = now.strftime(TIMESTAMP_FORMAT)
+
+    # next_token pagination is sequential, so each table's sync window is split into date ranges
+    # that are walked on their own threads over the shared session; pages are handed back through
+    # a queue and processed here as they arrive
+    pages_queue = queue.Queue()
+    with ThreadPoolExecutor(max_workers=MAX_WORKERS) as executor:
+        ranges_left = {}
+        start_dates = {}
+        for table, label in TABLES.items():
+            last_sync = sync_state[f"{table}_last_sync"]
+            log.info(f"Syncing {label} data since {last_sync}")
+            start_dates[table] = datetime.strptime(last_sync, TIMESTAMP_FORMAT).date()
+            ranges = date_ranges(start_dates[table], now.date())
+            ranges_left[table] = len(ranges)
+            url = urljoin(base_url, f"usercollection/{table}")
+            for start_date, end_date in ranges:
+                pages = fetch_pages(url, label, start_date, end_date)
+                executor.submit(pump_pages, table, pages, pages_queue)
+
+        page_counts = dict.fromkeys(TABLES, 0)
+        failed_tables = set()
+        tables_left = len(TABLES)
+        while tables_left:
+            table, data, succeeded = pages_queue.get()
+
+            # A None page marks the end of one date range; checkpoint the table once all of its ranges are done.
+            # A table with a failed range keeps its last sync date so the next sync fetches that range again.
+            # Syncs start from the date of the last sync, so the checkpoint is also skipped when that date
+            # would not move, as on repeated syncs within a day
+            if data is None:
+                ranges_left[table] -= 1
+                if not succeeded:
+                    failed_tables.add(table)
+                if not ranges_left[table]:
+                    tables_left -= 1
+                    if table in failed_tables:
+                        log.warning(f"Not advancing the {TABLES[table]} sync date because some of its date ranges failed")
+                    elif start_dates[table] < now.date():
+                        sync_state[f"{table}_last_sync"] = current_time
+                        yield op.checkpoint(dict(sync_state))
                 continue
 
-            response.raise_for_status()
-            data = response.json()
+            items = data.get('data') or []
+            for item in items:
+                # Ensure all records have an id for primary key purposes
+                if 'id' not in item:
+                    # Use date as id if not present
+                    item['id'] = item.get('day', f"unknown_{time.time()}")
 
-            # Process the data
-            if 'data' in data and data['data']:
-                for item in data['data']:
-                    # Ensure all records have an id for primary key purposes
-                    if 'id' not in item:
-                        # Use date as id if not present
-                        item['id'] = item.get('day', f"unknown_{time.time()}")
-
-                    yield op.update("daily_activity", item)
-
-            # Check for pagination
-            next_token = data.get('next_token')
-            page_count += 1
+            # The SDK has no batched update, so emit the page through map() rather than a per-record loop
+            yield from map(partial(op.update, table), items)
 
             # Log progress
-            log.info(f"Processed page {page_count} of daily activity data with {len(data.get('data', []))} records")
-
-            # Create a checkpoint every ~10 minutes of processing
-            if time.time() - last_checkpoint_time > 600:
-                yield op.checkpoint({"daily_activity_last_sync": current_time})
-                last_checkpoint_time = time.time()
-                log.info("Created checkpoint during daily activity sync")
-
-            # Break if no more pages
-            if not next_token:
-                break
-
-            # Be nice to the API - add a small delay between requests
-            time.sleep(1)
-
-        except requests.exceptions.RequestException as e:
-            log.severe(f"Error fetching daily activity data: {str(e)}")
-            # For transient errors, we might want to retry with backoff
-            if hasattr(e, 'response') and e.response and 500 <= e.response.status_code < 600:
-                log.warning(f"Server error {e.response.status_code}, retrying in 30 seconds")
-                time.sleep(30)
-                continue
-            else:
-                # For client errors or other issues, stop the sync
-                break
-
+            page_counts[table] += 1
+            log.info(f"Processed page {page_counts[table]} of {TABLES[table]} data with {len(items)} records")
 
-def sync_daily_sleep(base_url, headers, last_sync, current_time):
-    """Sync daily sleep data from Oura API"""
-    log.info(f"Syncing daily sleep data since {last_sync}")
-
-    # Convert datetime strings to date strings for API
-    start_date = datetime.strptime(last_sync, "%Y-%m-%dT%H:%M:%SZ").strftime("%Y-%m-%d")
-    end_date = datetime.strptime(current_time, "%Y-%m-%dT%H:%M:%SZ").strftime("%Y-%m-%d")
-
-    endpoint = "usercollection/daily_sleep"
-    url = urljoin(base_url, endpoint)
-
-    next_token = None
-    page_count = 0
-    last_checkpoint_time = time.time()
 
+def date_ranges(start, end):
+    """Split the start to end dates into RANGE_DAYS long (start_date, end_date) string pairs"""
+    # Neighbouring ranges share their boundary day, so none is missed whether end_date is inclusive or not
+    ranges = []
+    range_start = start
     while True:
-        try:
-            params = {
-                "start_date": start_date,
-                "end_date": end_date
-            }
-
-            if next_token:
-                params["next_token"] = next_token
-
-            log.info(f"Requesting daily sleep data: {url} with params: {params}")
-            response = requests.get(url, headers=headers, params=params)
-
-            # Handle potential rate limiting
-            if response.status_code == 429:
-                retry_after = int(response.headers.get('Retry-After', 60))
-                log.warning(f"Rate limited. Waiting for {retry_after} seconds")
-                time.sleep(retry_after)
-                continue
-
-            response.raise_for_status()
-            data = response.json()
-
-            # Process the data
-            if 'data' in data and data['data']:
-                for item in data['data']:
-                    # Ensure all records have an id for primary key purposes
-                    if 'id' not in item:
-                        # Use date as id if not present
-                        item['id'] = item.get('day', f"unknown_{time.time()}")
-
-                    yield op.update("daily_sleep", item)
-
-            # Check for pagination
-            next_token = data.get('next_token')
-            page_count += 1
+        range_end = min(range_start + timedelta(days=RANGE_DAYS), end)
+        ranges.append((range_start.strftime(DATE_FORMAT), range_end.strftime(DATE_FORMAT)))
+        if range_end >= end:
+            return ranges
+        range_start = range_end
+
+
+def pump_pages(table, pages, pages_queue):
+    """Put each page of a date range on the queue from a worker thread, followed by a None end marker
+    flagged with whether the whole range was fetched"""
+    succeeded = False
+    try:
+        for data in pages:
+            pages_queue.put((table, data, True))
+        succeeded = True
+    except Exception as e:
+        log.severe(f"Error fetching {TABLES[table]} data: {str(e)}")
+    finally:
+        pages_queue.put((table, None, succeeded))
+
+
+def fetch_pages(url, label, start_date, end_date):
+    """Yield each page of a table's date range from Oura API, following next_token"""
+    # Built once per date range; only next_token changes from page to page
+    params = {
+        "start_date": start_date,
+        "end_date": end_date
+    }
 
-            # Log progress
-            log.info(f"Processed page {page_count} of daily sleep data with {len(data.get('data', []))} records")
-
-            # Create a checkpoint every ~10 minutes of processing
-            if time.time() - last_checkpoint_time > 600:
-                yield op.checkpoint({"daily_sleep_last_sync": current_time})
-                last_checkpoint_time = time.time()
-                log.info("Created checkpoint during daily sleep sync")
-
-            # Break if no more pages
-            if not next_token:
-                break
-
-            # Be nice to the API - add a small delay between requests
-            time.sleep(1)
-
-        except requests.exceptions.RequestException as e:
-            log.severe(f"Error fetching daily sleep data: {str(e)}")
-            # For transient errors, we might want to retry with backoff
-            if hasattr(e, 'response') and e.response and 500 <= e.response.status_code < 600:
-                log.warning(f"Server error {e.response.status_code}, retrying in 30 seconds")
-                time.sleep(30)
-                continue
-            else:
-                # For client errors or other issues, stop the sync
-                break
+    # Rate limiting and server errors are retried by the session, so any error left here ends the
+    # range and is reported by pump_pages
+    while True:
+        log.info(f"Requesting {label} data: {url} with params: {params}")
+        RATE_LIMITER.acquire()
+        response = _SESSION.get(url, params=params)
+        response.raise_for_status()
+        data = json_loads(response.content)
+        yield data
+
+        # Check for pagination
+        next_token = data.get('next_token')
+
+        # Break if no more pages
+        if not next_token:
+            break
+        params["next_token"] = next_token
+
+        # Pace the next page by the rate limit headers instead of waiting for a 429
+        wait_for_rate_limit(response)
 
 # Create connector object
 connector = Connector(update=update, schema=schema)
@@ -1,5 +1,6 @@
 from fivetran_connector_sdk import Connector, Operations as op, Logging as log
 import requests
+from concurrent.futures import ThreadPoolExecutor
 from datetime import datetime, timezone, timedelta
 from dateutil import parser
 
@@ -74,15 +75,19 @@ def get_api_key(configuration):
         raise KeyError("Missing api_key in configuration")
     return str(api_key)
 
+def fetch_endpoint(session, endpoint, params):
+    """Fetch one Oura usercollection endpoint and return the decoded response"""
+    url = f"https://api.ouraring.com/v2/usercollection/{endpoint}"
+    response = session.get(url, params=params)
+    response.raise_for_status()
+    return response.json()
+
 def update(configuration: dict, state: dict):
     """Extract data from the source and yield operations"""
     try:
         # Get API key from configuration
         api_key = get_api_key(configuration)
 
-        # Setup API client headers
-        headers = {"Authorization": f"Bearer {api_key}"}
-
         # Get start date from state or use default (30 days ago)
         default_start_date = (datetime.now(timezone.utc) - timedelta(days=30)).strftime("%Y-%m-%d")
         start_date = state.get('last_sync_date', default_start_date)
@@ -90,24 +95,23 @@ def update(configuration: dict, state: dict):
         # Set current time for checkpoint updates
         current_date = datetime.now(timezone.utc).strftime("%Y-%m-%d")
 
-        # Sync daily activity data
-        try:
-            log.info(f"Syncing daily activity data since {start_date}")
-
-            # API endpoint for daily activity
-            url = "https://api.ouraring.com/v2/usercollection/daily_activity"
-
-            # Request parameters
-            params = {
-                "start_date": start_date,
-                "end_date": current_date
-            }
+        # Request parameters
+        params = {
+            "start_date": start_date,
+            "end_date": current_date
+        }
 
-            # Make API request
-            response = requests.get(url, headers=headers, params=params)
-            response.raise_for_status()
+        # The endpoints are independent, so fetch them concurrently and process them in order below;
+        # both share one session's connection pool, which is closed once both requests finish
+        log.info(f"Syncing daily activity and daily sleep data since {start_date}")
+        with requests.Session() as session, ThreadPoolExecutor(max_workers=2) as executor:
+            session.headers["Authorization"] = f"Bearer {api_key}"
+            activity_future = executor.submit(fetch_endpoint, session, "daily_activity", params)
+            sleep_future = executor.submit(fetch_endpoint, session, "daily_sleep", params)
 
-            data = response.json()
+        # Sync daily activity data
+        try:
+            data = activity_future.result()
 
             # Process activity data
             for activity in data.get('data', []):
@@ -143,22 +147,7 @@ def update(configuration: dict, state: dict):
 
         # Sync daily sleep data
         try:
-            log.info(f"Syncing daily sleep data since {start_date}")
-
-            # API endpoint for daily sleep
-            url = "https://api.ouraring.com/v2/usercollection/daily_sleep"
-
-            # Request parameters
-            params = {
-                "start_date": start_date,
-                "end_date": current_date
-            }
-
-            # Make API request
-            response = requests.get(url, headers=headers, params=params)
-            response.raise_for_status()
-
-            data = response.json()
+            data = sleep_future.result()
 
             # Process sleep data
             for sleep in data.get('data', []):